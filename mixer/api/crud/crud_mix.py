@@ -1,16 +1,16 @@
 import uuid
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
 from mixer.api import models
 
 
-def get_mix(db: Session, mix_id: str):
-    return db.query(models.Mix).filter(models.Mix.id == mix_id).first()
+def get_mix(db: Session, mix_id: uuid.UUID):
+    return db.get(models.Mix, mix_id, options=[selectinload(models.Mix.tracks)])
 
 
 def create_mix(db: Session):
-    db_mix = models.Mix(id=str(uuid.uuid4()))
+    db_mix = models.Mix()
     db.add(db_mix)
     db.commit()
     db.refresh(db_mix)
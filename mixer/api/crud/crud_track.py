@@ -1,23 +1,79 @@
 import uuid
+from typing import Optional
 
 from sqlalchemy.orm import Session
 
 from mixer.api import models, schemas
 
 
-def get_track(db: Session, track_id: str):
-    return db.query(models.Track).filter(models.Track.id == track_id).first()
+def get_track(db: Session, track_id: uuid.UUID):
+    return db.get(models.Track, track_id)
 
 
-def create_track(db: Session, track: schemas.TrackCreate, mix_id: str):
+def get_analysed_track(db: Session, content_hash: str):
+    return (
+        db.query(models.Track)
+        .filter(models.Track.content_hash == content_hash)
+        .filter(models.Track.bpm.is_not(None))
+        .order_by(models.Track.downbeats.is_(None))
+        .first()
+    )
+
+
+def create_track(db: Session, track: schemas.TrackCreate, mix_id: uuid.UUID):
     db_track = models.Track(
-        id=str(uuid.uuid4()),
         mix_id=mix_id,
         bucket_id=track.bucket_id,
         filename=track.filename,
         content_type=track.content_type,
+        content_hash=track.content_hash,
     )
     db.add(db_track)
     db.commit()
     db.refresh(db_track)
     return db_track
+
+
+def create_tracks(db: Session, tracks: list[schemas.TrackCreate], mix_id: uuid.UUID):
+    db_tracks = [
+        models.Track(
+            mix_id=mix_id,
+            bucket_id=track.bucket_id,
+            filename=track.filename,
+            content_type=track.content_type,
+            content_hash=track.content_hash,
+        )
+        for track in tracks
+    ]
+    db.add_all(db_tracks)
+    db.commit()
+    for db_track in db_tracks:
+        db.refresh(db_track)
+    return db_tracks
+
+
+def update_track(
+    db: Session,
+    db_track: models.Track,
+    bpm: Optional[float] = None,
+    downbeats: Optional[list[float]] = None,
+):
+    if bpm is not None:
+        db_track.bpm = bpm
+    if downbeats is not None:
+        db_track.downbeats = downbeats
+    db.commit()
+    db.refresh(db_track)
+    return db_track
+
+
+def copy_analysis(db: Session, db_track: models.Track):
+    # Fill in missing analysis from another upload of identical content
+    if db_track.downbeats is not None or db_track.content_hash is None:
+        return db_track
+    analysed_track = get_analysed_track(db, db_track.content_hash)
+    if analysed_track is None or analysed_track.id == db_track.id:
+        return db_track
+    return update_track(
+        db, db_track, bpm=analysed_track.bpm, downbeats=analysed_track.downbeats
+    )
@@ -1,15 +1,64 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import os
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+from sqlalchemy import Connection, create_engine, inspect, text
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Shared by the API and the worker, which run in separate containers
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./sql_app.db")
+
+# Columns added to tables created by earlier versions, with their SQLite types
+ADDED_TRACK_COLUMNS = {"content_hash": "VARCHAR", "bpm": "FLOAT", "downbeats": "JSON"}
+
+# SQLite connections are otherwise restricted to the thread that created them
+connect_args = (
+    {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
 )
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    pass
+
+
+def init_db():
+    """Upgrade existing tables and create missing ones"""
+    with engine.begin() as connection:
+        upgrade_schema(connection)
+        Base.metadata.create_all(bind=connection)
+
+
+def upgrade_schema(connection: Connection):
+    """
+    Migrate tables created by earlier versions, which create_all leaves unchanged.
+    Track analysis columns are added, and IDs stored as hyphenated strings are
+    rewritten in the 32 character hex form the Uuid type uses on SQLite.
+    Tables that are already up to date are left unchanged.
+    """
+    # Only SQLite databases were created with the earlier schema
+    if connection.dialect.name != "sqlite":
+        return
+    inspector = inspect(connection)
+    if not inspector.has_table("mix") or not inspector.has_table("track"):
+        return
+
+    track_columns = {column["name"] for column in inspector.get_columns("track")}
+    for name, column_type in ADDED_TRACK_COLUMNS.items():
+        if name not in track_columns:
+            connection.execute(
+                text(f"ALTER TABLE track ADD COLUMN {name} {column_type}")
+            )
+    connection.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_track_content_hash ON track (content_hash)")
+    )
+
+    connection.execute(text("UPDATE mix SET id = REPLACE(id, '-', '')"))
+    connection.execute(
+        text(
+            "UPDATE track SET id = REPLACE(id, '-', ''), "
+            "mix_id = REPLACE(mix_id, '-', '')"
+        )
+    )
 
 
 def get_db():
@@ -1,13 +1,26 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from mixer.api.database import Base, engine
+from mixer.api.database import init_db
+from mixer.api.minio_client import ensure_bucket
 from mixer.api.routers.mix import mix_router
 from mixer.api.routers.track import track_router
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create database tables and the minio bucket before serving requests"""
+    await asyncio.gather(
+        asyncio.to_thread(init_db),
+        asyncio.to_thread(ensure_bucket),
+    )
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -1,18 +1,122 @@
+import functools
 import os
+from typing import Iterator
 
+import urllib3
 from minio import Minio
+from minio.error import S3Error
 
 MINIO_ENDPOINT = os.environ["MINIO_ENDPOINT"]
 MINIO_ACCESS_KEY = os.environ["MINIO_ACCESS_KEY"]
 MINIO_SECRET_KEY = os.environ["MINIO_SECRET_KEY"]
 MINIO_BUCKET = "my-bucket"
+MINIO_PART_SIZE = 10 * 1024 * 1024  # Size of each part in multipart uploads
+MINIO_PARALLEL_UPLOADS = 4  # Number of parts uploaded concurrently
+MINIO_MAX_CONCURRENT_DOWNLOADS = 8  # Number of objects downloaded concurrently
+MINIO_MAX_CONCURRENT_UPLOADS = 4  # Number of objects uploaded concurrently
+MINIO_MAX_CONNECTIONS = 32  # Connections kept open to MinIO and shared by all routes
+
+http_client = urllib3.PoolManager(
+    timeout=urllib3.Timeout(connect=300, read=300),
+    maxsize=MINIO_MAX_CONNECTIONS,
+    block=True,
+    retries=urllib3.Retry(
+        total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]
+    ),
+)
 
 minio_client = Minio(
     MINIO_ENDPOINT,
     access_key=MINIO_ACCESS_KEY,
     secret_key=MINIO_SECRET_KEY,
     secure=False,  # Change to True if your MinIO uses HTTPS
+    http_client=http_client,
 )
 
-if not minio_client.bucket_exists(MINIO_BUCKET):
-    minio_client.make_bucket(MINIO_BUCKET)
+
+def object_exists(bucket_name: str, object_name: str) -> bool:
+    """
+    Check whether an object is stored in minio.
+
+    Parameters
+    ----------
+    bucket_name : str
+        name of the bucket that may contain the object
+    object_name : str
+        name of the object
+
+    Returns
+    -------
+    bool
+        True if the object exists
+    """
+    try:
+        minio_client.stat_object(bucket_name, object_name)
+    except S3Error as exc:
+        if exc.code == "NoSuchKey":
+            return False
+        raise
+    return True
+
+
+def read_object(bucket_name: str, object_name: str) -> bytes:
+    """
+    Read the full contents of an object in minio.
+
+    Parameters
+    ----------
+    bucket_name : str
+        name of the bucket containing the object
+    object_name : str
+        name of the object
+
+    Returns
+    -------
+    bytes
+        contents of the object
+    """
+    response = minio_client.get_object(bucket_name, object_name)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def stream_object(bucket_name: str, object_name: str) -> Iterator[bytes]:
+    """
+    Stream the contents of an object in minio, releasing the connection afterwards.
+
+    Parameters
+    ----------
+    bucket_name : str
+        name of the bucket containing the object
+    object_name : str
+        name of the object
+
+    Yields
+    ------
+    bytes
+        chunk of the object contents
+    """
+    response = minio_client.get_object(bucket_name, object_name)
+    try:
+        yield from response.stream()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+@functools.lru_cache(maxsize=None)
+def ensure_bucket(bucket_name: str = MINIO_BUCKET) -> None:
+    """
+    Create a bucket in minio if it does not already exist.
+    The check is only made once per bucket for each process.
+
+    Parameters
+    ----------
+    bucket_name : str
+        name of the bucket
+    """
+    if not minio_client.bucket_exists(bucket_name):
+        minio_client.make_bucket(bucket_name)
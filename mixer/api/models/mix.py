@@ -1,12 +1,17 @@
-from sqlalchemy import Column, String
-from sqlalchemy.orm import relationship
+import uuid
+
+from sqlalchemy import Uuid
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from mixer.api.database import Base
+from mixer.api.models.track import Track
 
 
 class Mix(Base):
     __tablename__ = "mix"
 
-    id = Column(String, primary_key=True, index=True)
+    id: Mapped[uuid.UUID] = mapped_column(
+        Uuid, primary_key=True, index=True, default=uuid.uuid4
+    )
 
-    tracks = relationship("Track", back_populates="mix")
+    tracks: Mapped[list[Track]] = relationship(back_populates="mix")
@@ -1,16 +1,46 @@
-from sqlalchemy import Column, ForeignKey, String
-from sqlalchemy.orm import relationship
+import uuid
+from typing import TYPE_CHECKING, Optional
+
+from sqlalchemy import JSON, Float, ForeignKey, String, Uuid
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from mixer.api.database import Base
 
+if TYPE_CHECKING:
+    from mixer.api.models.mix import Mix
+
+
+def content_object_name(content_hash: str) -> str:
+    """
+    Name of the minio object holding audio with a given content hash.
+    Objects are named by their content, so the audio behind a hash never changes.
+    """
+    return f"tracks/{content_hash}"
+
 
 class Track(Base):
     __tablename__ = "track"
 
-    id = Column(String, primary_key=True, index=True)
-    mix_id = Column(String, ForeignKey("mix.id"))
-    bucket_id = Column(String)
-    filename = Column(String)
-    content_type = Column(String)
+    id: Mapped[uuid.UUID] = mapped_column(
+        Uuid, primary_key=True, index=True, default=uuid.uuid4
+    )
+    mix_id: Mapped[Optional[uuid.UUID]] = mapped_column(Uuid, ForeignKey("mix.id"))
+    bucket_id: Mapped[str] = mapped_column(String)
+    filename: Mapped[str] = mapped_column(String)
+    content_type: Mapped[str] = mapped_column(String)
+    content_hash: Mapped[Optional[str]] = mapped_column(
+        String, index=True, nullable=True
+    )
+    bpm: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    downbeats: Mapped[Optional[list[float]]] = mapped_column(
+        JSON(none_as_null=True), nullable=True
+    )
+
+    mix: Mapped[Optional["Mix"]] = relationship(back_populates="tracks")
 
-    mix = relationship("Mix", back_populates="tracks")
+    @property
+    def object_name(self) -> str:
+        # Tracks uploaded before objects were named by content are named by filename
+        if self.content_hash is None:
+            return self.filename
+        return content_object_name(self.content_hash)
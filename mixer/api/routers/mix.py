@@ -1,16 +1,16 @@
-import tempfile
+import uuid
 
-import soundfile as sf
+from celery.result import AsyncResult
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from mixer.api import schemas
 from mixer.api.crud import crud_mix
 from mixer.api.database import get_db
-from mixer.api.minio_client import minio_client
-from mixer.processors.sync import get_track_groups, mix_track_group
-from mixer.processors.track import SAMPLE_RATE, TrackProcessor
+from mixer.api.minio_client import MINIO_BUCKET, stream_object
+from mixer.api.tasks import queue_mix_processing
+from mixer.api.worker import celery_app
 
 mix_router = APIRouter(prefix="/mix", tags=["Mix"])
 
@@ -26,7 +26,7 @@ def create_mix(response: Response, db: Session = Depends(get_db)):
         Mix created in DB
     """
     mix = crud_mix.create_mix(db)
-    response.set_cookie(key="mix_id", value=mix.id)
+    response.set_cookie(key="mix_id", value=str(mix.id))
     return mix
 
 
@@ -45,7 +45,7 @@ def get_current_mix(
     Raises
     ------
     HTTPException
-        If the mix ID request cookie is not present, a 400 error is raised
+        If the mix ID request cookie is not present or is not a valid ID, a 400 error is raised
     HTTPException
         If a mix could not be retrieved from the database using the ID, a 404 error is raised
     """
@@ -54,7 +54,13 @@ def get_current_mix(
         raise HTTPException(
             status_code=400, detail="A mix could not be found in the current session"
         )
-    mix = crud_mix.get_mix(db, mix_id)
+    try:
+        mix_uuid = uuid.UUID(mix_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400, detail="Invalid mix ID in the current session"
+        ) from exc
+    mix = crud_mix.get_mix(db, mix_uuid)
     if not mix:
         raise HTTPException(
             status_code=404,
@@ -64,13 +70,13 @@ def get_current_mix(
 
 
 @mix_router.get("/{mix_id}", response_model=schemas.Mix)
-def get_mix_by_id(mix_id: str, db: Session = Depends(get_db)):
+def get_mix_by_id(mix_id: uuid.UUID, db: Session = Depends(get_db)):
     """
     Get a mix by its ID if it exists.
 
     Parameters
     ----------
-    mix_id : str
+    mix_id : uuid.UUID
         ID of mix in database
 
     Returns
@@ -108,43 +114,51 @@ def discard_mix(request: Request, response: Response):
     return {"message": f"Mix {mix_id} removed from session"}
 
 
-@mix_router.post("/process")
-def process_mix(
-    request: Request, response: Response, db: Session = Depends(get_db)
-) -> FileResponse:
+@mix_router.post("/process", response_model=schemas.MixProcess)
+def process_mix(request: Request, response: Response, db: Session = Depends(get_db)):
     """
-    Trigger processing of the mix using uploaded tracks and designated cue points.
-
-    Parameters
-    ----------
-
+    Queue processing of the mix using uploaded tracks and designated cue points.
+    Tracks are analysed in parallel before the mix is processed.
 
     Returns
     -------
     mix : schemas.MixProcess
-        message describing mix processing status
+        ID of the processing job and its current state
     """
     mix = get_current_mix(request, response, db)
+    job = queue_mix_processing(mix)
+    return {"job_id": job.id, "state": job.state}
 
-    tracklist = []
-    for track in mix.tracks:
-        audio = minio_client.get_object(track.bucket_id, track.filename)
-        with tempfile.NamedTemporaryFile(delete=True) as temp:
-            for a in audio.stream():
-                temp.write(a)
-            temp.flush()
 
-            track_proc = TrackProcessor(temp.name)
-            track_proc.load()
-            track_proc.calculate_bpm()
-            track_proc.calculate_downbeats()
-            tracklist.append(track_proc)
+@mix_router.get("/process/{job_id}", response_model=schemas.MixProcess)
+def get_processed_mix(job_id: str):
+    """
+    Get the state of a mix processing job, or the processed mix audio once complete.
 
-    track_groups = get_track_groups(tracklist)
-    track_group = max(track_groups, key=lambda x: len(x.tracks))
-    combined_audio = mix_track_group(track_group)
+    Parameters
+    ----------
+    job_id : str
+        ID of the processing job
 
-    output_path = f"{mix.id}.mp3"
-    sf.write(output_path, combined_audio, int(SAMPLE_RATE))
+    Returns
+    -------
+    mix : schemas.MixProcess | StreamingResponse
+        state of the processing job if it has not succeeded yet,
+        otherwise the processed mix audio
+
+    Raises
+    ------
+    HTTPException
+        If the processing job failed, a 500 error is raised
+    """
+    job = AsyncResult(job_id, app=celery_app)
+    if job.state == "FAILURE":
+        raise HTTPException(
+            status_code=500, detail=f"Mix could not be processed: {job.result}"
+        )
+    if job.state != "SUCCESS":
+        return {"job_id": job_id, "state": job.state}
 
-    return FileResponse(output_path)
+    return StreamingResponse(
+        stream_object(MINIO_BUCKET, job.result), media_type="audio/mpeg"
+    )
@@ -1,19 +1,106 @@
+import asyncio
 import io
-import tempfile
+import uuid
+from typing import BinaryIO, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+import blake3
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile
 from minio.error import S3Error
 from sqlalchemy.orm import Session
 
 from mixer.api import schemas
 from mixer.api.crud import crud_track
 from mixer.api.database import get_db
-from mixer.api.minio_client import MINIO_BUCKET, minio_client
+from mixer.api.minio_client import (
+    MINIO_BUCKET,
+    MINIO_MAX_CONCURRENT_UPLOADS,
+    MINIO_PARALLEL_UPLOADS,
+    MINIO_PART_SIZE,
+    minio_client,
+    object_exists,
+    read_object,
+)
+from mixer.api.models.track import content_object_name
 from mixer.processors.track import TrackProcessor
 
 track_router = APIRouter(prefix="/track", tags=["Track"])
 
 
+def _hash_file(file: BinaryIO) -> tuple[str, int]:
+    # Hash the spooled upload in blocks, then rewind it so that it can be uploaded
+    file_hash = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    size = 0
+    while block := file.read(MINIO_PART_SIZE):
+        file_hash.update(block)
+        size += len(block)
+    file.seek(0)
+    return file_hash.hexdigest(), size
+
+
+def _get_session_mix_id(request: Request) -> uuid.UUID:
+    mix_id = request.cookies.get("mix_id")
+    if not mix_id:
+        raise HTTPException(
+            status_code=400,
+            detail="Mix not found. Create a mix then add the track again.",
+        )
+    try:
+        return uuid.UUID(mix_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400, detail="Invalid mix ID in the current session"
+        ) from exc
+
+
+def _validate_file(file: UploadFile) -> tuple[str, str]:
+    if file.filename is None or file.content_type is None:
+        raise HTTPException(status_code=400, detail="Invalid file")
+    if not file.filename.endswith((".mp3", ".wav")):
+        raise HTTPException(status_code=400, detail="Invalid file format")
+    return file.filename, file.content_type
+
+
+async def _upload_track(
+    file: UploadFile, filename: str, content_type: str
+) -> tuple[schemas.TrackCreate, Optional[str]]:
+    # Returns the name of the object if this upload created it, for removal on failure
+    # Name the object by its content, so that analysis shared by content hash
+    # always describes the stored audio, and identical uploads are stored once
+    content_hash, size = await asyncio.to_thread(_hash_file, file.file)
+    name = content_object_name(content_hash)
+    created_object = None
+    try:
+        if not await asyncio.to_thread(object_exists, MINIO_BUCKET, name):
+            await asyncio.to_thread(
+                minio_client.put_object,
+                MINIO_BUCKET,
+                name,
+                data=file.file,
+                length=size,
+                content_type=content_type,
+                part_size=MINIO_PART_SIZE,
+                num_parallel_uploads=MINIO_PARALLEL_UPLOADS,
+            )
+            created_object = name
+    except S3Error as exc:
+        raise HTTPException(
+            status_code=500, detail=f"Error saving to MinIO: {exc}"
+        ) from exc
+    track = schemas.TrackCreate(
+        bucket_id=MINIO_BUCKET,
+        filename=filename,
+        content_type=content_type,
+        content_hash=content_hash,
+    )
+    return track, created_object
+
+
+def _remove_objects(object_names: list[str]) -> None:
+    # Remove objects uploaded by a request that failed, so that they are not orphaned
+    for name in object_names:
+        minio_client.remove_object(MINIO_BUCKET, name)
+
+
 @track_router.post("/", response_model=schemas.Track)
 async def add_track(request: Request, file: UploadFile, db: Session = Depends(get_db)):
     """
@@ -32,7 +119,7 @@ async def add_track(request: Request, file: UploadFile, db: Session = Depends(ge
     Raises
     ------
     HTTPException
-        If the mix ID request cookie is not present, a 400 error is raised
+        If the mix ID request cookie is not present or is not a valid ID, a 400 error is raised
     HTTPException
         If the audio file does not have a filename or content type, a 400 error is raised
     HTTPException
@@ -40,53 +127,91 @@ async def add_track(request: Request, file: UploadFile, db: Session = Depends(ge
     HTTPException
         If the audio file could not be saved to minio, a 500 error is raised
     """
-    mix_id = request.cookies.get("mix_id")
-    if not mix_id:
-        raise HTTPException(
-            status_code=400,
-            detail="Mix not found. Create a mix then add the track again.",
-        )
+    mix_uuid = _get_session_mix_id(request)
+    filename, content_type = _validate_file(file)
 
-    # Validate file format
-    if file.filename is None or file.content_type is None:
-        raise HTTPException(status_code=400, detail="Invalid file")
-    if not file.filename.endswith((".mp3", ".wav")):
-        raise HTTPException(status_code=400, detail="Invalid file format")
+    track, created_object = await _upload_track(file, filename, content_type)
+    try:
+        db_track = crud_track.create_track(db, track, mix_uuid)
+    except Exception:
+        if created_object is not None:
+            await asyncio.to_thread(_remove_objects, [created_object])
+        raise
+    return db_track
+
+
+@track_router.post("/bulk", response_model=list[schemas.Track])
+async def add_tracks(
+    request: Request, files: list[UploadFile], db: Session = Depends(get_db)
+):
+    """
+    Upload several tracks to the minio bucket and add them all to the current mix.
+
+    Files are uploaded concurrently and the tracks are inserted in a single transaction.
+
+    Parameters
+    ----------
+    files : list[UploadFile]
+        audio files
 
+    Returns
+    -------
+    tracks : list[schemas.Track]
+        tracks added to database with minio metadata, in upload order
+
+    Raises
+    ------
+    HTTPException
+        If the mix ID request cookie is not present or is not a valid ID, a 400 error is raised
+    HTTPException
+        If any audio file does not have a filename or content type, a 400 error is raised
+    HTTPException
+        If any audio file is not the correct format, a 400 error is raised
+    HTTPException
+        If any audio file could not be saved to minio, a 500 error is raised
+    """
+    mix_uuid = _get_session_mix_id(request)
+    # Every file is validated before any is uploaded
+    validated_files = [(file, *_validate_file(file)) for file in files]
+
+    # Each upload already runs parallel part uploads, so bound the number of files in flight
+    semaphore = asyncio.Semaphore(MINIO_MAX_CONCURRENT_UPLOADS)
+
+    async def upload(
+        file: UploadFile, filename: str, content_type: str
+    ) -> tuple[schemas.TrackCreate, Optional[str]]:
+        async with semaphore:
+            return await _upload_track(file, filename, content_type)
+
+    # Let every upload finish, so that all objects created are known if any fail
+    results = await asyncio.gather(
+        *(upload(*validated_file) for validated_file in validated_files),
+        return_exceptions=True,
+    )
+    uploads = [result for result in results if not isinstance(result, BaseException)]
+    created_objects = [name for _, name in uploads if name is not None]
     try:
-        # Save the file to MinIO
-        file_data = file.file.read()
-        file_data_stream = io.BytesIO(file_data)
-
-        result = minio_client.put_object(
-            MINIO_BUCKET,
-            file.filename,
-            data=file_data_stream,
-            length=len(file_data),
-            content_type=file.content_type,
-        )
-        track = schemas.TrackCreate(
-            bucket_id=result.bucket_name,
-            filename=file.filename,
-            content_type=file.content_type,
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        db_tracks = crud_track.create_tracks(
+            db, [track for track, _ in uploads], mix_uuid
         )
-        db_track = crud_track.create_track(db, track, mix_id)
-        return db_track
-
-    except S3Error as exc:
-        raise HTTPException(
-            status_code=500, detail=f"Error saving to MinIO: {exc}"
-        ) from exc
+    except Exception:
+        # The batch is rejected as a whole, so remove the objects it uploaded
+        await asyncio.to_thread(_remove_objects, created_objects)
+        raise
+    return db_tracks
 
 
 @track_router.get("/{track_id}", response_model=schemas.Track)
-def get_track_by_id(track_id: str, db: Session = Depends(get_db)):
+def get_track_by_id(track_id: uuid.UUID, db: Session = Depends(get_db)):
     """
     Get a track's metadata using its ID, if it exists.
 
     Parameters
     ----------
-    track_id : str
+    track_id : uuid.UUID
         ID of track in database
 
     Returns
@@ -107,22 +232,31 @@ def get_track_by_id(track_id: str, db: Session = Depends(get_db)):
 
 @track_router.get("/{track_id}/analysis", response_model=schemas.TrackAnalysis)
 def get_track_analysis(
-    track_id: str, downbeats: bool = True, db: Session = Depends(get_db)
+    track_id: uuid.UUID,
+    request: Request,
+    response: Response,
+    downbeats: bool = True,
+    db: Session = Depends(get_db),
 ):
     """
     Get the time points of a track's downbeats.
+    Analysis is stored against the track so that it is only calculated once,
+    and reused from any other track with identical audio content.
+    As analysis is determined by the audio content, the content hash is used as an ETag
+    so that clients can revalidate cached analysis without it being sent again.
 
     Parameters
     ----------
-    track_id : str
+    track_id : uuid.UUID
         ID of track in database
     downbeats : bool
         If downbeats should be calculated for track
 
     Returns
     -------
-    track_analysis : schemas.TrackAnalysis
-        analysis of track including tempo and downbeats
+    track_analysis : schemas.TrackAnalysis | Response
+        analysis of track including tempo and downbeats,
+        or an empty 304 response if the client's cached analysis is still valid
 
     Raises
     ------
@@ -135,27 +269,49 @@ def get_track_analysis(
     if not track:
         raise HTTPException(status_code=404, detail="Track not found.")
 
-    audio = minio_client.get_object(track.bucket_id, track.filename)
+    if track.content_hash is not None:
+        etag = f'"{track.content_hash}-{"downbeats" if downbeats else "bpm"}"'
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
 
-    with tempfile.NamedTemporaryFile(delete=True) as temp:
-        for a in audio.stream():
-            temp.write(a)
-        temp.flush()
+    track = crud_track.copy_analysis(db, track)
 
-        track_processor = TrackProcessor(temp.name, name=track.filename)
-        track_processor.load()
-        track_processor.calculate_bpm()
-        if track_processor.bpm is None:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Tempo could not be calculated for {track.filename}",
-            )
+    if track.bpm is not None and (not downbeats or track.downbeats is not None):
+        return schemas.TrackAnalysis(
+            track_id=track.id,
+            bpm=track.bpm,
+            downbeats=track.downbeats if downbeats else None,
+        )
+
+    audio = io.BytesIO(read_object(track.bucket_id, track.object_name))
 
-        track_analysis = schemas.TrackAnalysis(
-            track_id=track.id, bpm=track_processor.bpm, downbeats=None
+    # Requests run in a threadpool, where each thread would start its own process pool
+    track_processor = TrackProcessor(
+        audio, name=track.filename, bpm=track.bpm, num_threads=1
+    )
+    track_processor.load()
+    if downbeats:
+        # Tempo is then derived from the beats tracked with the downbeats
+        track_processor.calculate_downbeats()
+    if track_processor.bpm is None:
+        track_processor.calculate_bpm()
+    if track_processor.bpm is None:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Tempo could not be calculated for {track.filename}",
         )
-        if downbeats:
-            track_processor.calculate_downbeats()
-            track_analysis.downbeats = track_processor.downbeats.tolist()
+
+    track_analysis = schemas.TrackAnalysis(
+        track_id=track.id,
+        bpm=track_processor.bpm,
+        downbeats=track_processor.downbeats.tolist() if downbeats else None,
+    )
+
+    crud_track.update_track(
+        db, track, bpm=track_analysis.bpm, downbeats=track_analysis.downbeats
+    )
 
     return track_analysis
@@ -1,2 +1,2 @@
-from .mix import Mix, MixDelete  # noqa
+from .mix import Mix, MixDelete, MixProcess  # noqa
 from .track import Track, TrackAnalysis, TrackCreate  # noqa
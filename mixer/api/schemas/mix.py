@@ -1,3 +1,4 @@
+import uuid
 from typing import Optional
 
 from pydantic import BaseModel
@@ -10,7 +11,7 @@ class MixBase(BaseModel):
 
 
 class Mix(BaseModel):
-    id: str
+    id: uuid.UUID
     tracks: Optional[list[Track]]
 
     class Config:
@@ -19,3 +20,8 @@ class Mix(BaseModel):
 
 class MixDelete(BaseModel):
     message: str
+
+
+class MixProcess(BaseModel):
+    job_id: str
+    state: str
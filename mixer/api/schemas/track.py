@@ -1,3 +1,4 @@
+import uuid
 from typing import Optional
 
 from pydantic import BaseModel
@@ -10,18 +11,18 @@ class TrackBase(BaseModel):
 
 
 class TrackCreate(TrackBase):
-    pass
+    content_hash: Optional[str] = None
 
 
 class Track(TrackBase):
-    id: str
-    mix_id: str
+    id: uuid.UUID
+    mix_id: uuid.UUID
 
     class Config:
         orm_mode = True
 
 
 class TrackAnalysis(BaseModel):
-    track_id: str
+    track_id: uuid.UUID
     bpm: float
     downbeats: Optional[list[float]]
@@ -0,0 +1,214 @@
+import asyncio
+import io
+import uuid
+
+from celery import chord
+from celery.result import AsyncResult
+
+from mixer.api import models
+from mixer.api.crud import crud_mix, crud_track
+from mixer.api.database import SessionLocal
+from mixer.api.minio_client import (
+    MINIO_BUCKET,
+    MINIO_MAX_CONCURRENT_DOWNLOADS,
+    minio_client,
+    read_object,
+)
+from mixer.api.worker import celery_app
+from mixer.processors.sync import get_track_groups, mix_track_group
+from mixer.processors.track import TrackProcessor, encode_mp3
+
+
+def queue_mix_processing(mix: models.Mix) -> AsyncResult:
+    """
+    Queue analysis of each track in a mix followed by processing of the mix.
+    Tracks are analysed by separate tasks so that they run in parallel across
+    worker processes.
+
+    Parameters
+    ----------
+    mix : models.Mix
+        mix stored in database
+
+    Returns
+    -------
+    AsyncResult
+        result of the mix processing task
+    """
+    analyses = [analyse_track_task.s(str(track.id)) for track in mix.tracks]
+    return chord(analyses)(process_mix_task.s(str(mix.id)))
+
+
+@celery_app.task
+def analyse_track_task(track_id: str) -> str:
+    """
+    Calculate the tempo and downbeats of a track and store them in the database,
+    if they have not already been stored.
+
+    Parameters
+    ----------
+    track_id : str
+        ID of track in database
+
+    Returns
+    -------
+    track_id : str
+        ID of analysed track
+
+    Raises
+    ------
+    ValueError
+        If a track could not be retrieved from the database using the ID
+    """
+    db = SessionLocal()
+    try:
+        track = crud_track.get_track(db, uuid.UUID(track_id))
+        if not track:
+            raise ValueError(
+                f"A track with ID {track_id} could not be found in the database"
+            )
+        track = crud_track.copy_analysis(db, track)
+        if track.bpm is None or track.downbeats is None:
+            track_proc = _fetch_and_analyse(track)
+            crud_track.update_track(
+                db,
+                track,
+                bpm=track_proc.bpm,
+                downbeats=track_proc.downbeats.tolist(),
+            )
+    finally:
+        db.close()
+
+    return track_id
+
+
+@celery_app.task
+def process_mix_task(analysed_track_ids: list[str], mix_id: str) -> str:
+    """
+    Process a mix using its uploaded tracks and save the result to minio.
+
+    Parameters
+    ----------
+    analysed_track_ids : list[str]
+        IDs of tracks analysed before processing
+    mix_id : str
+        ID of mix in database
+
+    Returns
+    -------
+    object_name : str
+        name of the processed mix audio file in the minio bucket
+
+    Raises
+    ------
+    ValueError
+        If a mix could not be retrieved from the database using the ID
+    """
+    db = SessionLocal()
+    try:
+        mix = crud_mix.get_mix(db, uuid.UUID(mix_id))
+        if not mix:
+            raise ValueError(
+                f"A mix with ID {mix_id} could not be found in the database"
+            )
+        tracklist = asyncio.run(_fetch_and_analyse_tracks(mix.tracks))
+    finally:
+        db.close()
+
+    track_groups = get_track_groups(tracklist)
+    track_group = max(track_groups, key=lambda x: len(x.tracks))
+    combined_audio = mix_track_group(track_group)
+
+    mix_audio = io.BytesIO(encode_mp3(combined_audio))
+
+    object_name = f"mixes/{mix_id}.mp3"
+    minio_client.put_object(
+        MINIO_BUCKET,
+        object_name,
+        mix_audio,
+        length=mix_audio.getbuffer().nbytes,
+        content_type="audio/mpeg",
+    )
+
+    return object_name
+
+
+async def _fetch_and_analyse_tracks(
+    tracks: list[models.Track],
+) -> list[TrackProcessor]:
+    """
+    Download and analyse tracks concurrently in worker threads.
+    The number of simultaneous downloads from minio is bounded.
+
+    Parameters
+    ----------
+    tracks : list[models.Track]
+        tracks stored in database
+
+    Returns
+    -------
+    list[TrackProcessor]
+        loaded and analysed tracks
+    """
+    semaphore = asyncio.Semaphore(MINIO_MAX_CONCURRENT_DOWNLOADS)
+
+    async def fetch_and_analyse(track: models.Track) -> TrackProcessor:
+        async with semaphore:
+            audio = await asyncio.to_thread(
+                read_object, track.bucket_id, track.object_name
+            )
+        return await asyncio.to_thread(_analyse, track, audio)
+
+    return await asyncio.gather(*[fetch_and_analyse(track) for track in tracks])
+
+
+def _fetch_and_analyse(track: models.Track) -> TrackProcessor:
+    """
+    Download a track from minio and calculate its tempo and downbeats.
+
+    Parameters
+    ----------
+    track : models.Track
+        track stored in database
+
+    Returns
+    -------
+    TrackProcessor
+        loaded and analysed track
+    """
+    return _analyse(track, read_object(track.bucket_id, track.object_name))
+
+
+def _analyse(track: models.Track, audio: bytes) -> TrackProcessor:
+    """
+    Load a track's audio and calculate its tempo and downbeats,
+    reusing any analysis already stored for the track.
+
+    Parameters
+    ----------
+    track : models.Track
+        track stored in database
+    audio : bytes
+        encoded audio of track
+
+    Returns
+    -------
+    track_proc : TrackProcessor
+        loaded and analysed track
+    """
+    # Prefork workers are daemonic, so cannot start madmom's process pool
+    track_proc = TrackProcessor(
+        io.BytesIO(audio),
+        name=track.filename,
+        bpm=track.bpm,
+        downbeats=track.downbeats,
+        num_threads=1,
+    )
+    track_proc.load()
+    # Track downbeats first so tempo can be derived from the tracked beats
+    if track_proc.downbeats.size == 0:
+        track_proc.calculate_downbeats()
+    if track_proc.bpm is None:
+        track_proc.calculate_bpm()
+
+    return track_proc
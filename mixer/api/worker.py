@@ -0,0 +1,31 @@
+import os
+
+from celery import Celery
+from celery.signals import worker_init
+
+from mixer.api import models  # noqa: F401
+from mixer.api.database import engine, init_db
+
+REDIS_URL = os.environ["REDIS_URL"]
+MIX_PROCESSING_QUEUE = "mix_processing"
+
+celery_app = Celery(
+    "mixer",
+    broker=REDIS_URL,
+    backend=REDIS_URL,
+    include=["mixer.api.tasks"],
+)
+
+celery_app.conf.update(
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    task_routes={"mixer.api.tasks.*": {"queue": MIX_PROCESSING_QUEUE}},
+)
+
+
+@worker_init.connect
+def prepare_database(**kwargs):
+    """Create or upgrade database tables before the worker consumes tasks"""
+    init_db()
+    # Prefork children must open their own connections rather than share these
+    engine.dispose()
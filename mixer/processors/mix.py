@@ -1,29 +1,43 @@
+import functools
+
 import numpy as np
+from numba import njit
 
 from mixer.logger import logger
-from mixer.processors.track import SAMPLE_RATE, TrackProcessor
+from mixer.processors.track import TrackProcessor
+
+FADE_CURVES = ("linear", "equal_power")  # Envelope shapes available for fades
 
 
 class MixProcessor:
-    def __init__(self, bpm: float):
+    def __init__(self, bpm: float, fade_curve: str = "linear"):
         """
         Parameters
         ----------
         bpm : float
             tempo of mix that all tracks will by stretched to
+        fade_curve : str
+            If 'linear', overlapping tracks are crossfaded with linear envelopes
+            If 'equal_power', sine and cosine envelopes keep overlap loudness constant
         """
-        self._audio = np.array([])
+        if fade_curve not in FADE_CURVES:
+            raise ValueError(f"Fade curve must be one of {FADE_CURVES}.")
+
+        self._audio = np.empty(0, dtype=np.float32)
+        self._length = 0
         self._bpm = bpm
+        self._fade_curve = fade_curve
         self._track_count = 0
 
-        self.prev_downbeats = np.array([])
+        self.prev_downbeats = np.empty(0, dtype=np.float32)
+        self.prev_downbeat_samples = np.empty(0, dtype=np.int64)
         self.prev_start_sample = None
         self.prev_end_sample = None
         self.prev_overlap_start_sample = None
 
     @property
     def audio(self) -> np.ndarray:
-        return self._audio
+        return self._audio[: self._length]
 
     @property
     def bpm(self) -> float:
@@ -33,6 +47,22 @@ class MixProcessor:
     def track_count(self) -> int:
         return self._track_count
 
+    def reserve(self, total_samples: int) -> None:
+        """
+        Grow the mix buffer so that it can hold a number of samples without reallocating.
+
+        Parameters
+        ----------
+        total_samples : int
+            number of samples the mix buffer should be able to hold
+        """
+        if total_samples <= len(self._audio):
+            return
+
+        audio = np.zeros(total_samples, dtype=np.float32)
+        audio[: self._length] = self._audio[: self._length]
+        self._audio = audio
+
     def add_track(
         self, track: TrackProcessor, cue_in: int, cue_out: int, overlap: int = 16
     ) -> None:
@@ -53,71 +83,108 @@ class MixProcessor:
         overlap : int
             number of downbeats for previous and current tracks where they will overlap
         """
-        track.bpm = self._bpm
+        # Downbeats of the original audio can come from the analysis cache, which
+        # stretching disables, and stretching rescales them to the new tempo
         if track.downbeats.size == 0:
             track.calculate_downbeats()
+        track.bpm = self._bpm
 
         curr_downbeats = track.downbeats
         curr_downbeats = curr_downbeats[cue_in:cue_out]
+        # Cue at the same rounded sample positions that cropping uses
+        curr_downbeat_samples = track.downbeat_samples[cue_in:cue_out]
 
-        curr_cue_in_sample = int(curr_downbeats[0] * SAMPLE_RATE)
-        curr_cue_out_sample = int(curr_downbeats[-1] * SAMPLE_RATE)
+        curr_cue_in_sample = int(curr_downbeat_samples[0])
+        curr_cue_out_sample = int(curr_downbeat_samples[-1])
         curr_audio = track.audio[curr_cue_in_sample:curr_cue_out_sample]
-        curr_downbeats -= curr_downbeats[0]
+        curr_downbeats = curr_downbeats - curr_downbeats[0]
+        curr_downbeat_samples = curr_downbeat_samples - curr_downbeat_samples[0]
+        assert curr_audio.dtype == np.float32
 
         if self._track_count == 0:
-            self._audio = curr_audio
-            self._track_count += 1
-            self.prev_downbeats = curr_downbeats
-            return
-
-        curr_fade_duration = int(curr_downbeats[overlap] * SAMPLE_RATE)
-        prev_fade_duration = int(
-            (self.prev_downbeats[-1] - self.prev_downbeats[-1 * overlap]) * SAMPLE_RATE
-        )
-
-        prev_track_faded = fade_track(self._audio, prev_fade_duration, mode="out")
-        curr_track_faded = fade_track(curr_audio, curr_fade_duration, mode="in")
-
-        curr_track_faded = np.pad(
-            curr_track_faded, (len(self._audio) - prev_fade_duration, 0)
+            start_sample = 0
+            prev_fade_envelope = np.empty(0, dtype=np.float32)
+            curr_fade_envelope = np.empty(0, dtype=np.float32)
+        else:
+            curr_fade_duration = int(curr_downbeat_samples[overlap])
+            prev_fade_duration = int(
+                self.prev_downbeat_samples[-1]
+                - self.prev_downbeat_samples[-1 * overlap]
+            )
+            start_sample = self._length - prev_fade_duration
+            prev_fade_envelope = _fade_envelope(
+                prev_fade_duration, "out", self._fade_curve
+            )
+            curr_fade_envelope = _fade_envelope(
+                curr_fade_duration, "in", self._fade_curve
+            )
+
+        # Grow the mix buffer geometrically so that repeated additions stay linear
+        end_sample = max(start_sample + len(curr_audio), self._length)
+        if end_sample > len(self._audio):
+            self.reserve(max(end_sample, 2 * len(self._audio)))
+
+        peak = _crossfade(
+            self._audio[start_sample:end_sample],
+            curr_audio,
+            prev_fade_envelope,
+            curr_fade_envelope,
         )
+        self._length = end_sample
 
-        self._audio = combine_tracks(prev_track_faded, curr_track_faded)
+        # Every write is normalised, the first track included, so the rest of the mix
+        # is within [-1, 1] and only the region just written can exceed it
+        if peak > 1.0:
+            np.multiply(self.audio, 1.0 / peak, out=self.audio)
 
         self._track_count += 1
         self.prev_downbeats = curr_downbeats
+        self.prev_downbeat_samples = curr_downbeat_samples
 
         logger.info(f"Added {track} to mix")
 
 
-def fade_track(audio: np.ndarray, fade_duration: int, mode: str = "in") -> np.ndarray:
+def fade_track(
+    audio: np.ndarray, fade_duration: int, mode: str = "in", curve: str = "linear"
+) -> np.ndarray:
     """
-    Fade an audio track in or out with a linear envelope.
+    Fade an audio track in or out.
+    The fade is applied in place, so the input audio is modified.
 
     Parameters
     ----------
     audio : np.ndarray
-        mono representation of audio file
+        mono float32 representation of audio file
     fade_duration : int
         number of samples over which fade will be applied
     mode : str
         If 'in', amplitude of audio file will increase from 0 to 1 over fade duration
         If 'out' amplitude of audio file decrease from 1 to 0 over fade duration
+    curve : str
+        If 'linear', amplitude changes linearly over fade duration
+        If 'equal_power', amplitude follows a quarter sine or cosine wave
+
+    Returns
+    -------
+    audio : np.ndarray
+        faded audio
     """
     if mode not in ["in", "out"]:
         raise ValueError("Mode must be 'in' or 'out'.")
+    if curve not in FADE_CURVES:
+        raise ValueError(f"Curve must be one of {FADE_CURVES}.")
+    assert audio.dtype == np.float32
 
     if mode == "in":
         start_sample = 0
         end_sample = fade_duration
-        fade_envelope = np.linspace(0, 1, fade_duration)
     else:
         start_sample = len(audio) - fade_duration
         end_sample = len(audio)
-        fade_envelope = np.linspace(1, 0, fade_duration)
+    fade_envelope = _fade_envelope(fade_duration, mode, curve)
 
-    audio[start_sample:end_sample] *= fade_envelope
+    fade_region = audio[start_sample:end_sample]
+    np.multiply(fade_region, fade_envelope, out=fade_region)
 
     return audio
 
@@ -127,13 +194,14 @@ def combine_tracks(
 ) -> np.ndarray:
     """
     Combine two audio tracks into one audio track.
+    The shorter track is treated as if it were padded with zeros at the end.
 
     Parameters
     ----------
     prev_audio : np.ndarray
-        mono representation of previous audio file
+        mono float32 representation of previous audio file
     next_audio : np.ndarray
-        mono representation of next audio file
+        mono float32 representation of next audio file
     normalise : bool
         If True, amplitude of final audio track will be normalised between -1.0 and 1.0
 
@@ -141,18 +209,95 @@ def combine_tracks(
     -------
     combined_audio : np.ndarray
     """
-    # Pad the shorter audio with zeros at end so that they have the same length
-    length_diff = len(prev_audio) - len(next_audio)
+    assert prev_audio.dtype == np.float32 and next_audio.dtype == np.float32
 
-    if length_diff > 0:
-        next_audio = np.pad(next_audio, (0, length_diff))
-    elif length_diff < 0:
-        prev_audio = np.pad(prev_audio, (0, -length_diff))
+    overlap = min(len(prev_audio), len(next_audio))
+    longer_audio = prev_audio if len(prev_audio) > len(next_audio) else next_audio
 
-    combined_audio = prev_audio + next_audio
+    combined_audio = np.empty(len(longer_audio), dtype=np.float32)
+    np.add(prev_audio[:overlap], next_audio[:overlap], out=combined_audio[:overlap])
+    combined_audio[overlap:] = longer_audio[overlap:]
 
-    if normalise:
-        if np.max(np.abs(combined_audio)) > 1.0:
-            combined_audio /= np.max(np.abs(combined_audio))
+    if normalise and combined_audio.size > 0:
+        peak = max(combined_audio.max(), -combined_audio.min())
+        if peak > 1.0:
+            np.multiply(combined_audio, 1.0 / peak, out=combined_audio)
 
     return combined_audio
+
+
+@functools.lru_cache(maxsize=8)
+def _fade_envelope(fade_duration: int, mode: str, curve: str = "linear") -> np.ndarray:
+    """
+    Create a fade envelope.
+    Envelopes are cached, as fade durations repeat for tracks mixed at the same tempo,
+    so the returned array is read-only.
+
+    Parameters
+    ----------
+    fade_duration : int
+        number of samples in envelope
+    mode : str
+        If 'in', envelope increases from 0 to 1
+        If 'out', envelope decreases from 1 to 0
+    curve : str
+        If 'linear', envelope is a straight ramp
+        If 'equal_power', envelope is a quarter sine or cosine wave
+
+    Returns
+    -------
+    np.ndarray
+        fade envelope
+    """
+    if mode == "in":
+        fade_envelope = np.linspace(0, 1, fade_duration, dtype=np.float32)
+    else:
+        fade_envelope = np.linspace(1, 0, fade_duration, dtype=np.float32)
+    if curve == "equal_power":
+        # Squared gains of opposing envelopes sum to one across the overlap
+        fade_envelope = np.sin(fade_envelope * np.float32(np.pi / 2))
+    fade_envelope.setflags(write=False)
+    return fade_envelope
+
+
+@njit(cache=True, fastmath=True)
+def _crossfade(
+    mix_audio: np.ndarray,
+    audio: np.ndarray,
+    fade_out_envelope: np.ndarray,
+    fade_in_envelope: np.ndarray,
+) -> float:
+    """
+    Fade out the start of a mix region, fade in an audio track and add it to the region.
+    Fading, mixing and peak detection are fused into a single pass, and the audio track
+    itself is left unmodified.
+
+    Parameters
+    ----------
+    mix_audio : np.ndarray
+        region of mix buffer that audio is added to, modified in place
+    audio : np.ndarray
+        mono representation of audio file, no longer than the mix region
+    fade_out_envelope : np.ndarray
+        envelope applied to the start of the mix region
+    fade_in_envelope : np.ndarray
+        envelope applied to the start of the audio
+
+    Returns
+    -------
+    peak : float
+        maximum absolute amplitude of the mix region
+    """
+    peak = 0.0
+    for i in range(len(mix_audio)):
+        sample = mix_audio[i]
+        if i < len(fade_out_envelope):
+            sample *= fade_out_envelope[i]
+        if i < len(audio):
+            if i < len(fade_in_envelope):
+                sample += audio[i] * fade_in_envelope[i]
+            else:
+                sample += audio[i]
+        mix_audio[i] = sample
+        peak = max(peak, abs(sample))
+    return peak
@@ -1,21 +1,33 @@
+import functools
 import os
-from typing import cast
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
 import essentia.standard as es
-import matplotlib.pyplot as plt
 import numpy as np
-import soundfile as sf
 
 from mixer.logger import logger
 from mixer.processors.mix import MixProcessor
-from mixer.processors.track import SAMPLE_RATE, TrackGroupProcessor, TrackProcessor
+from mixer.processors.track import (
+    SAMPLE_RATE,
+    TrackGroupProcessor,
+    TrackProcessor,
+    encode_mp3,
+)
+
+ANALYSIS_CACHE_DIR = ".mixer_cache"  # Directory holding analysis of local tracks
+BPM_EXCERPT_DURATION = 60.0  # Seconds of each track analysed when grouping by tempo
+# Processes madmom's eight downbeat networks are spread across when mixing,
+# safe here as the command line process is long-lived and not daemonic
+DOWNBEAT_PROCESSES = min(8, os.cpu_count() or 1)
 
 
 def main():
-    track_groups = evaluate_tracklist()
+    track_groups = evaluate_tracklist(cache_dir=ANALYSIS_CACHE_DIR)
     track_group = max(track_groups, key=lambda x: len(x.tracks))
     combined_audio = mix_track_group(track_group)
-    sf.write("combined.mp3", combined_audio, int(SAMPLE_RATE))
+    with open("combined.mp3", "wb") as file:
+        file.write(encode_mp3(combined_audio))
 
 
 def mix_track_group(track_group: TrackGroupProcessor) -> np.ndarray:
@@ -47,7 +59,9 @@ def mix_track_group(track_group: TrackGroupProcessor) -> np.ndarray:
     return mix.audio
 
 
-def evaluate_tracklist(tracklist_dir: str = "./data") -> list[TrackGroupProcessor]:
+def evaluate_tracklist(
+    tracklist_dir: str = "./data", cache_dir: Optional[str] = None, fast: bool = False
+) -> list[TrackGroupProcessor]:
     """
     Identify tracks in an input directory and combine them into groups.
 
@@ -55,19 +69,31 @@ def evaluate_tracklist(tracklist_dir: str = "./data") -> list[TrackGroupProcesso
     ----------
     tracklist_dir : str
         directory containing input tracks
+    cache_dir : Optional[str]
+        directory in which track analysis is stored between runs
+        if None, every track is analysed
+    fast : bool
+        If True, tempos are estimated with a lightweight estimator rather than beat tracking
 
     Returns
     -------
     track_groups : list[TrackGroupProcessors]
         all tracks in directory bundled into groups with similar tempos
     """
-    tracklist: list[TrackProcessor] = []
-    for file in os.listdir(tracklist_dir):
-        if file.endswith(".mp3"):
-            track = TrackProcessor(f"{tracklist_dir}/{file}")
-            track.load()
-            track.calculate_bpm()
-            tracklist.append(track)
+    track_paths = [
+        f"{tracklist_dir}/{file}"
+        for file in os.listdir(tracklist_dir)
+        if file.endswith(".mp3")
+    ]
+
+    # Analysis is CPU bound and independent per track, so spread it across processes
+    with ProcessPoolExecutor() as executor:
+        tracklist = list(
+            executor.map(
+                functools.partial(_load_and_analyse, cache_dir=cache_dir, fast=fast),
+                track_paths,
+            )
+        )
 
     logger.info(f"Loaded {len(tracklist)} tracks from {tracklist_dir}")
 
@@ -76,6 +102,36 @@ def evaluate_tracklist(tracklist_dir: str = "./data") -> list[TrackGroupProcesso
     return track_groups
 
 
+def _load_and_analyse(
+    track_path: str, cache_dir: Optional[str] = None, fast: bool = False
+) -> TrackProcessor:
+    """
+    Load a track and calculate its tempo, reusing cached analysis if available.
+
+    Parameters
+    ----------
+    track_path : str
+        location of track audio file
+    cache_dir : Optional[str]
+        directory in which track analysis is stored between runs
+    fast : bool
+        If True, tempo is estimated with a lightweight estimator rather than beat tracking
+
+    Returns
+    -------
+    track : TrackProcessor
+        loaded track with tempo calculated
+    """
+    # Downbeats are tracked later, when the track is mixed in the main process
+    track = TrackProcessor(
+        track_path, cache_dir=cache_dir, num_threads=DOWNBEAT_PROCESSES
+    )
+    track.load()
+    # A steady excerpt is enough to group tracks, and analysis is linear in length
+    track.calculate_bpm(excerpt=BPM_EXCERPT_DURATION, fast=fast)
+    return track
+
+
 def get_track_groups(
     tracklist: list[TrackProcessor], tempo_diff: int = 10
 ) -> list[TrackGroupProcessor]:
@@ -94,25 +150,19 @@ def get_track_groups(
     groups : list[TrackGroupProcessor]
         track groups for input tracks
     """
-    tracklist_bpm_sorted = sorted(tracklist, key=lambda x: cast(float, x.bpm))
+    analysed_tracks = sorted(
+        ((track.bpm, track) for track in tracklist if track.bpm is not None),
+        key=lambda item: item[0],
+    )
 
+    # Tracks are compared to the slowest track in their group
     groups: list[TrackGroupProcessor] = []
-    for track in tracklist_bpm_sorted:
-        if track.bpm is not None:
-            if not groups:
-                group = TrackGroupProcessor()
-                group.add_track(track)
-                groups.append(group)
-            elif groups[-1].tracks[0].bpm is not None:
-                if track.bpm - groups[-1].tracks[0].bpm <= tempo_diff:
-                    groups[-1].tracks.append(track)
-                else:
-                    group = TrackGroupProcessor()
-                    group.add_track(track)
-                    groups.append(group)
-
-    for group in groups:
-        group.calculate_bpm()
+    group_start_bpm = 0.0
+    for bpm, track in analysed_tracks:
+        if not groups or bpm - group_start_bpm > tempo_diff:
+            groups.append(TrackGroupProcessor())
+            group_start_bpm = bpm
+        groups[-1].add_track(track)
 
     logger.info(f"Organised tracks into {len(groups)} groups:")
     for i, group in enumerate(groups):
@@ -159,18 +209,29 @@ def plot_beats(audio: np.ndarray, beats: np.ndarray, audio_name: str) -> None:
     beats : np.ndarray
         time points of beats in audio
     """
+    # Plotting is a development aid, so matplotlib is only needed when it is used
+    import matplotlib.pyplot as plt
+
     # Plot waveform
     plt.figure(figsize=(10, 4))
     plt.plot(
-        np.linspace(0, len(audio) / SAMPLE_RATE, len(audio)),
+        np.arange(len(audio), dtype=np.float32) * np.float32(1.0 / SAMPLE_RATE),
         audio,
         label="Waveform",
         alpha=0.7,
     )
 
-    # Plot beat markers
-    for beat in beats:
-        plt.axvline(beat, color="red", alpha=0.8, linestyle="--", lw=1)
+    # Plot beat markers as a single collection spanning the full height of the axes
+    plt.vlines(
+        beats,
+        0,
+        1,
+        transform=plt.gca().get_xaxis_transform(),
+        color="red",
+        alpha=0.8,
+        linestyle="--",
+        lw=1,
+    )
 
     plt.title("Waveform with Beat Markers")
     plt.xlabel("Time (seconds)")
@@ -1,37 +1,105 @@
+import asyncio
+import functools
+import hashlib
+import math
+import os
 import pathlib
-from typing import Optional
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, Hashable, Optional, Sequence, TypeVar, Union
 
 import essentia.standard as es
 import numpy as np
-import pyrubberband as pyrb
+import soundfile as sf
 from madmom.features.downbeats import DBNDownBeatTrackingProcessor, RNNDownBeatProcessor
+from pedalboard import time_stretch
 
 from mixer.logger import logger
 
 SAMPLE_RATE = 44100  # Sample rate fixed for essentia
+DECODE_BLOCK_SIZE = 65536  # Number of frames decoded at a time
+CACHE_KEY_BLOCK_SIZE = 1024 * 1024  # Bytes hashed from each end of a file for caching
+MP3_BITRATE = "320k"  # Bitrate of encoded mixes
+SILENCE_FRAME_SIZE = 4410  # Samples per frame when detecting silence, 10 network frames
+SILENCE_THRESHOLD = 1e-3  # RMS below which a frame is treated as silent
+MIN_ACTIVE_DURATION = 10.0  # Shortest active region in seconds worth trimming to
+QUICK_TEMPO_TOLERANCE = 0.1  # Fraction of known tempo searched either side when quick
+
+T = TypeVar("T")
+_thread_processors = threading.local()
 
 
 class TrackProcessor:
     SAMPLE_RATE = SAMPLE_RATE
 
-    def __init__(self, file_path: str, name: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        source: Union[str, BinaryIO],
+        name: Optional[str] = None,
+        bpm: Optional[float] = None,
+        downbeats: Optional[Sequence[float]] = None,
+        num_threads: int = 1,
+        cache_dir: Optional[str] = None,
+        high_quality_stretch: bool = False,
+        memmap_dir: Optional[str] = None,
+        activation_processor: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+    ) -> None:
         """
         Parameters
         ----------
-        file_path : str
-            absolute or relative location of track audio file
+        source : Union[str, BinaryIO]
+            absolute or relative location of track audio file,
+            or file-like object containing the encoded audio
         name : Optional[str]
             name to give to track if not present in file path
+        bpm : Optional[float]
+            previously calculated tempo of audio file
+        downbeats : Optional[Sequence[float]]
+            previously calculated downbeat time points of audio file
+        num_threads : int
+            number of processes madmom spreads the downbeat tracking networks across
+            if 1, the networks run one after another in the calling process
+            madmom starts a process pool for higher values, which is never closed,
+            so only raise this in long-lived processes that may fork, not in daemonic workers
+        cache_dir : Optional[str]
+            directory in which analysis of a track file is stored between runs
+            if None, or if source is not a path, analysis is never cached
+        high_quality_stretch : bool
+            If True, time stretch with Rubber Band's R3 engine, which sounds better but is slower
+            If False, time stretch with the faster R2 engine
+        memmap_dir : Optional[str]
+            directory in which loaded audio is stored in a temporary memory-mapped file,
+            so the operating system can page out parts of long tracks that are not in use
+            if None, loaded audio is held in memory
+        activation_processor : Optional[Callable[[np.ndarray], np.ndarray]]
+            callable mapping mono audio at the fixed sample rate to beat and downbeat
+            activations at 100 frames per second, such as a model running on a GPU
+            if None, madmom's recurrent network ensemble is run on the CPU
         """
-        self._file_path = pathlib.Path(file_path)
-        if name is None:
-            self._name = self._file_path.stem
-        else:
+        self._source = source
+        if name is not None:
             self._name = name
+        elif isinstance(source, str):
+            self._name = pathlib.Path(source).stem
+        else:
+            self._name = "track"
 
-        self._audio = np.array([])
-        self._bpm = None
-        self._downbeats = np.array([])
+        self._audio = np.empty(0, dtype=np.float32)
+        self._bpm = bpm
+        self._set_downbeats(np.empty(0) if downbeats is None else np.asarray(downbeats))
+        self._beats = np.empty(0, dtype=np.float32)
+        # Tempo estimates for the current audio, cleared whenever the audio changes
+        self._bpm_estimates: dict[str, float] = {}
+
+        self._num_threads = num_threads
+
+        self._cache_dir = cache_dir
+        self._cache_key: Optional[str] = None
+        self._high_quality_stretch = high_quality_stretch
+        self._memmap_dir = memmap_dir
+        self._activation_processor = activation_processor
 
     def __str__(self):
         return self._name
@@ -44,12 +112,16 @@ class TrackProcessor:
     def downbeats(self) -> np.ndarray:
         return self._downbeats
 
+    @property
+    def downbeat_samples(self) -> np.ndarray:
+        return self._downbeat_samples
+
     @property
     def bpm(self) -> Optional[float]:
         return self._bpm
 
     @bpm.setter
-    def bpm(self, bpm: float) -> np.ndarray:
+    def bpm(self, bpm: float) -> None:
         """
         Time stretch audio file to increase BPM to target
 
@@ -57,47 +129,125 @@ class TrackProcessor:
         ----------
         bpm : float
             intended BPM of audio
+        """
+        self.stretch(bpm)
+
+    def stretch(self, bpm: float, verify: bool = False) -> np.ndarray:
+        """
+        Time stretch audio file to increase BPM to target.
+        Tempo and downbeats are updated from the stretch factor rather than re-analysed.
+        Audio is loaded first if it has not been already.
+
+        Parameters
+        ----------
+        bpm : float
+            intended BPM of audio
+        verify : bool
+            If True, tempo of the stretched audio is analysed again
 
         Returns
         -------
         np.ndarray
             time-stretched audio
         """
+        if self._audio.size == 0:
+            self.load()
         if self._bpm is None:
             self.calculate_bpm()
 
         assert self._bpm is not None
 
         stretch_factor = bpm / self._bpm
-        self._audio = pyrb.time_stretch(
-            self._audio, SAMPLE_RATE, stretch_factor
-        ).astype(np.float32)
-        self.calculate_bpm()
+        # Stretch in process on a (channels, samples) buffer rather than via the rubberband CLI
+        # pedalboard works in float32, so a contiguous float32 input is passed without a copy
+        audio = np.ascontiguousarray(self._audio, dtype=np.float32)
+        stretched_audio = time_stretch(
+            audio[np.newaxis, :],
+            SAMPLE_RATE,
+            stretch_factor,
+            high_quality=self._high_quality_stretch,
+        )
+        self._audio = np.ascontiguousarray(stretched_audio[0], dtype=np.float32)
+        self._bpm_estimates.clear()
+
+        # Stretching warps time linearly, so rescale the analysis rather than repeat it
+        # Cached analysis describes the original file, so stop using it
+        self._cache_dir = None
+        self._bpm = bpm
+        self._set_downbeats(self._downbeats / np.float32(stretch_factor))
+        self._beats = self._beats / np.float32(stretch_factor)
+        if verify:
+            self.calculate_bpm(from_beats=False)
 
         logger.info(f"Tempo for {self} set to {round(self._bpm, 2)}")
 
         return self._audio
 
-    def load(self, path: Optional[str] = None) -> np.ndarray:
+    def load(
+        self,
+        path: Optional[str] = None,
+        start: Optional[float] = None,
+        duration: Optional[float] = None,
+    ) -> np.ndarray:
         """
         Load an audio file from a given path.
+        Only the requested section of the file is decoded.
 
         Parameters
         ----------
         path : Optional[str]
             local path to audio file
-            if None, file_path attribute value used
+            if None, source attribute value used
+        start : Optional[float]
+            time in seconds from which to load audio
+            if None, audio is loaded from the beginning
+        duration : Optional[float]
+            number of seconds of audio to load
+            if None, audio is loaded to the end
 
         Returns
         -------
         np.ndarray
-            mono representation of audio file
+            mono float32 representation of audio file
         """
-        if path is None:
-            path = str(self._file_path.resolve())
+        source = self._source if path is None else path
+        if path is not None or start is not None or duration is not None:
+            # Cached analysis describes the whole source, not other files or sections of it
+            self._cache_dir = None
+
+        if isinstance(source, str):
+            path = str(pathlib.Path(source).resolve())
+            try:
+                sound_file = sf.SoundFile(path)
+            except RuntimeError:
+                # libsndfile cannot read every format, so fall back to essentia
+                if start is None and duration is None:
+                    loader = es.MonoLoader(filename=path, sampleRate=SAMPLE_RATE)
+                else:
+                    start_time = 0.0 if start is None else start
+                    loader = es.EasyLoader(
+                        filename=path,
+                        sampleRate=SAMPLE_RATE,
+                        startTime=start_time,
+                        endTime=1e6 if duration is None else start_time + duration,
+                    )
+                self._audio = loader()
+            else:
+                self._audio = _decode_sound_file(
+                    sound_file, start, duration, self._memmap_dir
+                )
+        else:
+            self._audio = decode_audio(source, start, duration, self._memmap_dir)
 
-        loader = es.MonoLoader(filename=path, sampleRate=SAMPLE_RATE)
-        self._audio = loader()
+        if self._memmap_dir is not None and not isinstance(self._audio, np.memmap):
+            # Decoders that cannot write into a mapped buffer are copied into one
+            audio = _allocate_audio(len(self._audio), self._memmap_dir)
+            audio[:] = self._audio
+            self._audio = audio
+
+        # Processing after load assumes contiguous float32 samples, whichever decoder ran
+        self._audio = np.ascontiguousarray(self._audio, dtype=np.float32)
+        self._bpm_estimates.clear()
 
         logger.info(f"Loaded audio for {self}")
 
@@ -106,6 +256,8 @@ class TrackProcessor:
     def crop(self, offset: int, length: int) -> None:
         """
         Crop track using number of downbeats.
+        Audio is kept from the offset downbeat up to, but not including, the final downbeat,
+        and downbeat time points are moved to start from the new beginning of the track.
 
         Parameters
         ----------
@@ -114,57 +266,573 @@ class TrackProcessor:
         length : int
             number of downbeats that new audio will contain
         """
-        if self.downbeats.size == 0:
+        if self._audio.size == 0 and self._downbeats.size == 0:
+            self.load()
+        if self._downbeats.size == 0:
             self.calculate_downbeats()
 
-        start_sample = int(self._downbeats[offset] * SAMPLE_RATE)
-        end_sample = int(self._downbeats[offset + length] * SAMPLE_RATE)
+        if offset < 0 or length < 0 or offset + length >= self._downbeats.size:
+            raise ValueError("Crop must start and end at downbeats of the track.")
 
-        self._audio = self._audio[start_sample : end_sample + 1]
+        start_time = float(self._downbeats[offset])
+        end_time = float(self._downbeats[offset + length])
+
+        if self._audio.size == 0:
+            # Downbeats are known before the audio, so only decode the cropped section
+            self.load(start=start_time, duration=end_time - start_time)
+        else:
+            start_sample = self._downbeat_samples[offset]
+            end_sample = self._downbeat_samples[offset + length]
+            # Contiguous float32, so libraries the cropped audio is passed to need not copy it
+            self._audio = np.ascontiguousarray(
+                self._audio[start_sample:end_sample], dtype=np.float32
+            )
+            self._bpm_estimates.clear()
+
+        # Move the kept downbeats to the new origin rather than tracking them again
+        self._set_downbeats(
+            self._downbeats[offset : offset + length + 1] - self._downbeats[offset]
+        )
+        kept_beats = (self._beats >= start_time) & (self._beats <= end_time)
+        self._beats = self._beats[kept_beats] - np.float32(start_time)
+        self._cache_dir = None
 
         logger.info(
             f"Cropped {self} audio between downbeats {offset} and {offset + length}"
         )
 
-    def calculate_bpm(self) -> float:
+    def calculate_bpm(
+        self,
+        excerpt: Optional[float] = None,
+        fast: bool = False,
+        from_beats: bool = True,
+    ) -> float:
         """
-        Determine BPM for audio using essentia
+        Determine BPM for audio using essentia.
+        If beats were tracked along with downbeats, tempo is derived from them instead.
+
+        Parameters
+        ----------
+        excerpt : Optional[float]
+            duration in seconds of excerpt from middle of audio to analyse
+            if None, the full audio is analysed
+        fast : bool
+            If True, estimate tempo alone with a lightweight onset-based estimator
+            If False, run full beat tracking, which is slower but more robust
+        from_beats : bool
+            If True, derive tempo from tracked beats when available
+            If False, always analyse the audio
 
         Returns
         -------
         bpm : float
             tempo of audio file
         """
-        rhythm_extractor = es.RhythmExtractor2013(method="degara")
-        self._bpm, _, _, _, _ = rhythm_extractor(self._audio)
+        if from_beats and self._beats.size >= 2:
+            # Average beat period over the track, using beats from downbeat tracking
+            beat_span = float(self._beats[-1] - self._beats[0])
+            self._bpm = 60.0 * (self._beats.size - 1) / beat_span
+            logger.info(f"Derived tempo for {self} from beats at {round(self._bpm, 2)}")
+            return self._bpm
+
+        cache_field = "bpm_fast" if fast else "bpm"
+        if excerpt is not None:
+            cache_field += f"_{excerpt:g}s"
+        if cache_field in self._bpm_estimates:
+            # Audio is unchanged since this analysis, so repeat calls need not redo it
+            self._bpm = self._bpm_estimates[cache_field]
+            return self._bpm
+        cached_analysis = self._cached_analysis()
+        if cache_field in cached_analysis:
+            self._bpm = float(cached_analysis[cache_field])
+            logger.info(f"Loaded cached tempo for {self} at {round(self._bpm, 2)}")
+            return self._bpm
+
+        audio = self._audio
+        if excerpt is not None:
+            excerpt_samples = int(excerpt * SAMPLE_RATE)
+            if excerpt_samples < len(audio):
+                excerpt_start = (len(audio) - excerpt_samples) // 2
+                audio = audio[excerpt_start : excerpt_start + excerpt_samples]
+
+        if fast:
+            bpm_estimator = _get_bpm_estimator()
+            bpm_estimator.reset()
+            self._bpm = float(bpm_estimator(audio))
+        else:
+            rhythm_extractor = _get_rhythm_extractor()
+            rhythm_extractor.reset()
+            self._bpm, _, _, _, _ = rhythm_extractor(audio)
 
         assert self._bpm is not None
+        self._bpm_estimates[cache_field] = self._bpm
+        self._cache_analysis(**{cache_field: np.asarray(self._bpm, dtype=np.float64)})
 
         logger.info(f"Calculated tempo for {self} at {round(self._bpm, 2)}")
 
         return self._bpm
 
-    def calculate_downbeats(self) -> None:
+    def calculate_downbeats(
+        self, quick: bool = False, beats_per_bar: Sequence[int] = (3, 4)
+    ) -> None:
         """
         Use madmom downbeat tracking to estimate downbeat time points for audio file.
+
+        Parameters
+        ----------
+        quick : bool
+            If True and tempo is known, only search tempi close to it,
+            which is faster but fails if the known tempo is wrong
+            If False, search madmom's full tempo range
+        beats_per_bar : Sequence[int]
+            numbers of beats per bar to model, e.g. (4,) for music known to be in 4/4
         """
-        proc = DBNDownBeatTrackingProcessor(beats_per_bar=[3, 4], fps=100)
-        act = RNNDownBeatProcessor()(self._audio)
-        proc_res = proc(act)
+        # Cached downbeats come from madmom's networks, so are not reused for other models
+        use_cache = self._activation_processor is None
+        # Restricted searches are less reliable, so do not replace a full analysis
+        full_search = not quick and tuple(beats_per_bar) == (3, 4)
+        cached_analysis = self._cached_analysis() if use_cache else {}
+        if "downbeats" in cached_analysis:
+            self._set_downbeats(cached_analysis["downbeats"])
+            if "beats" in cached_analysis:
+                self._beats = cached_analysis["beats"].astype(np.float32)
+            logger.info(f"Loaded cached downbeats for {self}")
+            return
+
+        assert self._audio.dtype == np.float32
+        # Leading and trailing silence holds no beats, so is not run through the model
+        active_start, active_end = _active_region(self._audio)
+        audio = self._audio[active_start:active_end]
+        # Processors reset their recurrent and HMM state at the start of each call
+        # madmom takes plain arrays as already at its 44.1 kHz rate and never resamples them
+        if self._activation_processor is None:
+            act = _get_rnn(self._num_threads)(audio)
+        else:
+            act = self._activation_processor(audio)
+        if quick and self._bpm is not None:
+            # Whole tempi keep the number of distinct cached trackers small
+            min_bpm = math.floor(self._bpm * (1 - QUICK_TEMPO_TOLERANCE))
+            max_bpm = math.ceil(self._bpm * (1 + QUICK_TEMPO_TOLERANCE))
+            dbn = _get_dbn(tuple(beats_per_bar), 100, min_bpm, max_bpm)
+        else:
+            dbn = _get_dbn(tuple(beats_per_bar), 100)
+        proc_res = dbn(act)
+        proc_res[:, 0] += active_start / SAMPLE_RATE
 
-        self._downbeats = proc_res[proc_res[:, 1] == 1, 0].astype(np.float32)
+        # Downbeats are the sparse rows in the first position of the bar
+        downbeat_rows = np.flatnonzero(proc_res[:, 1] == 1)
+        self._set_downbeats(proc_res[downbeat_rows, 0])
+        # Keep every beat too, as they give the tempo without a separate analysis
+        self._beats = proc_res[:, 0].astype(np.float32)
+        if use_cache and full_search:
+            self._cache_analysis(downbeats=self._downbeats, beats=self._beats)
 
         logger.info(f"Calculated downbeats for {self}")
 
+    async def load_async(
+        self,
+        path: Optional[str] = None,
+        start: Optional[float] = None,
+        duration: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Load an audio file in a worker thread, see load.
+        """
+        return await asyncio.to_thread(self.load, path, start, duration)
+
+    async def calculate_bpm_async(
+        self,
+        excerpt: Optional[float] = None,
+        fast: bool = False,
+        from_beats: bool = True,
+    ) -> float:
+        """
+        Determine BPM for audio in a worker thread, see calculate_bpm.
+        """
+        return await asyncio.to_thread(self.calculate_bpm, excerpt, fast, from_beats)
+
+    async def calculate_downbeats_async(
+        self, quick: bool = False, beats_per_bar: Sequence[int] = (3, 4)
+    ) -> None:
+        """
+        Estimate downbeat time points for audio in a worker thread, see calculate_downbeats.
+        """
+        await asyncio.to_thread(self.calculate_downbeats, quick, beats_per_bar)
+
+    def _set_downbeats(self, downbeats: np.ndarray) -> None:
+        """
+        Replace the track's downbeats, along with their nearest sample positions.
+
+        Parameters
+        ----------
+        downbeats : np.ndarray
+            downbeat time points of audio file
+        """
+        self._downbeats = np.asarray(downbeats, dtype=np.float32)
+        downbeat_samples = np.rint(self._downbeats.astype(np.float64) * SAMPLE_RATE)
+        self._downbeat_samples = downbeat_samples.astype(np.int64)
+
+    def _analysis_cache_path(self) -> Optional[pathlib.Path]:
+        """
+        Locate the cached analysis of the track's source file.
+
+        Returns
+        -------
+        Optional[pathlib.Path]
+            location of cached analysis, or None if analysis is not cached
+        """
+        if self._cache_dir is None or not isinstance(self._source, str):
+            return None
+        if self._cache_key is None:
+            self._cache_key = _content_key(self._source)
+        return pathlib.Path(self._cache_dir) / f"{self._cache_key}.npz"
+
+    def _cached_analysis(self) -> dict[str, np.ndarray]:
+        """
+        Read the cached analysis of the track's source file.
+        Missing or unreadable cache files are treated as empty.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            cached analysis fields
+        """
+        cache_path = self._analysis_cache_path()
+        if cache_path is None:
+            return {}
+        try:
+            with np.load(cache_path) as cached:
+                return dict(cached)
+        except (OSError, ValueError):
+            return {}
+
+    def _cache_analysis(self, **analysis: np.ndarray) -> None:
+        """
+        Add fields to the cached analysis of the track's source file.
+        The cache file is replaced atomically so concurrent readers never see it partly written.
+
+        Parameters
+        ----------
+        **analysis : np.ndarray
+            analysis fields to store
+        """
+        cache_path = self._analysis_cache_path()
+        if cache_path is None:
+            return
+
+        analysis = {**self._cached_analysis(), **analysis}
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_path.parent, delete=False) as file:
+            np.savez(file, **analysis)
+        os.replace(file.name, cache_path)
+
+
+def _content_key(path: str) -> str:
+    """
+    Fingerprint a file from its size and the bytes at either end of it.
+    Reading only the ends keeps the key cheap for large files,
+    while still changing on any re-encode or edit that alters the length or headers.
+
+    Parameters
+    ----------
+    path : str
+        location of file
+
+    Returns
+    -------
+    str
+        hex digest identifying the file's content
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as file:
+        digest.update(file.read(CACHE_KEY_BLOCK_SIZE))
+        if size > CACHE_KEY_BLOCK_SIZE:
+            file.seek(max(size - CACHE_KEY_BLOCK_SIZE, CACHE_KEY_BLOCK_SIZE))
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _active_region(audio: np.ndarray) -> tuple[int, int]:
+    """
+    Find the samples between the first and last frames of audio above silence.
+    If the active region is too short to analyse alone, the full audio is used.
+
+    Parameters
+    ----------
+    audio : np.ndarray
+        mono audio samples
+
+    Returns
+    -------
+    start : int
+        first sample of active region
+    end : int
+        sample after end of active region
+    """
+    num_frames = len(audio) // SILENCE_FRAME_SIZE
+    frames = audio[: num_frames * SILENCE_FRAME_SIZE].reshape(-1, SILENCE_FRAME_SIZE)
+    # Compare mean squares, avoiding a square root and a squared copy of the audio
+    mean_squares = np.einsum("ij,ij->i", frames, frames) / SILENCE_FRAME_SIZE
+    active_frames = np.flatnonzero(mean_squares > SILENCE_THRESHOLD**2)
+    if active_frames.size == 0:
+        return 0, len(audio)
+
+    start = int(active_frames[0]) * SILENCE_FRAME_SIZE
+    end = (int(active_frames[-1]) + 1) * SILENCE_FRAME_SIZE
+    if active_frames[-1] == num_frames - 1:
+        # Keep the partial frame at the end of the audio
+        end = len(audio)
+    if end - start < MIN_ACTIVE_DURATION * SAMPLE_RATE:
+        return 0, len(audio)
+    return start, end
+
+
+def decode_audio(
+    file: BinaryIO,
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    memmap_dir: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Decode an in-memory audio file without writing it to disk.
+    Formats that libsndfile cannot read, such as MP3, are piped through ffmpeg.
+    Audio is decoded in blocks so that only the mono output is held in full.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        file-like object containing the encoded audio
+    start : Optional[float]
+        time in seconds from which to decode audio
+        if None, audio is decoded from the beginning
+    duration : Optional[float]
+        number of seconds of audio to decode
+        if None, audio is decoded to the end
+    memmap_dir : Optional[str]
+        directory in which decoded audio is stored in a temporary memory-mapped file
+        if None, decoded audio is held in memory
+
+    Returns
+    -------
+    np.ndarray
+        mono representation of audio file at the fixed sample rate
+    """
+    # The file may have been read before, e.g. when a track is loaded again to crop it
+    file.seek(0)
+    try:
+        sound_file = sf.SoundFile(file)
+    except RuntimeError:
+        file.seek(0)
+        return _decode_with_ffmpeg(file, start, duration)
+
+    return _decode_sound_file(sound_file, start, duration, memmap_dir)
+
+
+def _decode_sound_file(
+    sound_file: sf.SoundFile,
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    memmap_dir: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Decode an open sound file in blocks, mixing down to mono and closing it afterwards.
+    Frames outside the requested section are skipped rather than decoded.
+
+    Parameters
+    ----------
+    sound_file : sf.SoundFile
+        sound file opened for reading
+    start : Optional[float]
+        time in seconds from which to decode audio
+        if None, audio is decoded from the beginning
+    duration : Optional[float]
+        number of seconds of audio to decode
+        if None, audio is decoded to the end
+    memmap_dir : Optional[str]
+        directory in which decoded audio is stored in a temporary memory-mapped file
+        if None, decoded audio is held in memory
+
+    Returns
+    -------
+    np.ndarray
+        mono representation of audio file at the fixed sample rate
+    """
+    with sound_file:
+        sample_rate = sound_file.samplerate
+        start_frame = 0
+        if start is not None:
+            start_frame = min(int(start * sample_rate), sound_file.frames)
+            sound_file.seek(start_frame)
+        frames = sound_file.frames - start_frame
+        if duration is not None:
+            frames = min(frames, int(duration * sample_rate))
+
+        audio = _allocate_audio(frames, memmap_dir)
+        if sound_file.channels == 1:
+            # Already mono, so decode straight into the output without mixing down
+            audio = sound_file.read(dtype="float32", out=audio)
+        else:
+            position = 0
+            for block in sound_file.blocks(
+                blocksize=DECODE_BLOCK_SIZE,
+                frames=frames,
+                dtype="float32",
+                always_2d=True,
+            ):
+                block_end = position + len(block)
+                np.mean(block, axis=1, out=audio[position:block_end])
+                position = block_end
+            audio = audio[:position]
+
+    if sample_rate != SAMPLE_RATE:
+        resampler = es.Resample(
+            inputSampleRate=sample_rate, outputSampleRate=SAMPLE_RATE
+        )
+        audio = resampler(audio)
+
+    return audio
+
+
+def _allocate_audio(frames: int, memmap_dir: Optional[str] = None) -> np.ndarray:
+    """
+    Allocate an uninitialised float32 buffer for decoded audio.
+
+    Parameters
+    ----------
+    frames : int
+        number of samples in buffer
+    memmap_dir : Optional[str]
+        directory in which to create a temporary file backing the buffer
+        if None, the buffer is held in memory
+
+    Returns
+    -------
+    np.ndarray
+        buffer for decoded audio
+    """
+    if memmap_dir is None or frames == 0:
+        return np.empty(frames, dtype=np.float32)
+
+    # The mapping keeps the unlinked file alive until the buffer is garbage collected
+    with tempfile.TemporaryFile(dir=memmap_dir) as file:
+        return np.memmap(file, dtype=np.float32, mode="w+", shape=(frames,))
+
+
+def _decode_with_ffmpeg(
+    file: BinaryIO, start: Optional[float] = None, duration: Optional[float] = None
+) -> np.ndarray:
+    """
+    Decode encoded audio to mono float samples by streaming it through ffmpeg.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        file-like object containing the encoded audio
+    start : Optional[float]
+        time in seconds from which to decode audio
+        if None, audio is decoded from the beginning
+    duration : Optional[float]
+        number of seconds of audio to decode
+        if None, audio is decoded to the end
+
+    Returns
+    -------
+    np.ndarray
+        mono representation of audio at the fixed sample rate
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If ffmpeg could not decode the audio
+    """
+    args = ["ffmpeg", "-loglevel", "error", "-i", "pipe:0"]
+    # Piped input cannot be seeked, but samples outside the section are never output
+    if start is not None:
+        args += ["-ss", str(start)]
+    if duration is not None:
+        args += ["-t", str(duration)]
+    args += ["-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+
+    with subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
+        assert proc.stdin is not None and proc.stdout is not None
+        writer = threading.Thread(target=_write_blocks, args=(file, proc.stdin))
+        writer.start()
+
+        # Accumulate into a bytearray so the array below is writable without a copy
+        output = bytearray()
+        while chunk := proc.stdout.read(DECODE_BLOCK_SIZE * 4):
+            output += chunk
+        writer.join()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+
+    return np.frombuffer(output, dtype=np.float32)
+
+
+def _write_blocks(file: BinaryIO, pipe: BinaryIO) -> None:
+    """
+    Copy a file-like object into a pipe in blocks, closing the pipe afterwards.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        file-like object to read from
+    pipe : BinaryIO
+        pipe to write to
+    """
+    try:
+        while block := file.read(DECODE_BLOCK_SIZE * 4):
+            pipe.write(block)
+    except BrokenPipeError:
+        pass
+    finally:
+        pipe.close()
+
+
+def encode_mp3(audio: np.ndarray) -> bytes:
+    """
+    Encode mono audio as MP3 by streaming it through ffmpeg,
+    as the pinned libsndfile cannot write MP3.
+
+    Parameters
+    ----------
+    audio : np.ndarray
+        mono audio samples at the fixed sample rate
+
+    Returns
+    -------
+    bytes
+        encoded MP3 audio
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If ffmpeg could not encode the audio
+    """
+    args = ["ffmpeg", "-loglevel", "error"]
+    args += ["-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0"]
+    args += ["-f", "mp3", "-b:a", MP3_BITRATE, "pipe:1"]
+
+    # Raw little-endian float32 bytes of the samples, viewed rather than copied
+    samples = np.ascontiguousarray(audio, dtype="<f4").data.cast("B")
+    encoded = subprocess.run(args, input=samples, stdout=subprocess.PIPE, check=True)
+    return encoded.stdout
+
 
 class TrackGroupProcessor:
     def __init__(self) -> None:
         self._tracks: list[TrackProcessor] = []
-        self._bpm: Optional[float] = None
+        # Running totals over tracks with a known tempo, so the average is O(1) to update
+        self._bpm_sum = 0.0
+        self._bpm_count = 0
 
     @property
     def bpm(self) -> Optional[float]:
-        return self._bpm
+        if self._bpm_count == 0:
+            return None
+        return self._bpm_sum / self._bpm_count
 
     @property
     def tracks(self) -> list[TrackProcessor]:
@@ -180,11 +848,224 @@ class TrackGroupProcessor:
             track to be added
         """
         self._tracks.append(track)
-        self.calculate_bpm()
+        if track.bpm is not None:
+            self._bpm_sum += track.bpm
+            self._bpm_count += 1
+
+    def remove_track(self, track: TrackProcessor) -> None:
+        """
+        Remove a track from the track group.
+        The track's tempo must not have changed since it was added,
+        otherwise call calculate_bpm afterwards.
+
+        Parameters
+        ----------
+        track : TrackProcessor
+            track to be removed
+        """
+        self._tracks.remove(track)
+        if track.bpm is not None:
+            self._bpm_sum -= track.bpm
+            self._bpm_count -= 1
 
     def calculate_bpm(self):
         """
-        Calculate average bpm of current tracks in group.
+        Recalculate average bpm of current tracks in group with a known tempo.
+        """
+        track_bpms = [track.bpm for track in self._tracks if track.bpm is not None]
+        self._bpm_sum = sum(track_bpms)
+        self._bpm_count = len(track_bpms)
+
+    async def prepare_all(self, max_concurrent: int = 2) -> None:
         """
-        track_bpms = [track.bpm for track in self._tracks]
-        self._bpm = sum(track_bpms) / len(track_bpms)
+        Load and calculate downbeats and tempo of every track in the group in threads.
+        Tracks are prepared concurrently, so one track can be read from disk
+        while another is being analysed.
+
+        Parameters
+        ----------
+        max_concurrent : int
+            maximum number of tracks prepared at once
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def prepare(track: TrackProcessor) -> None:
+            async with semaphore:
+                if track.audio.size == 0:
+                    await track.load_async()
+                if track.downbeats.size == 0:
+                    await track.calculate_downbeats_async()
+                if track.bpm is None:
+                    await track.calculate_bpm_async()
+
+        await asyncio.gather(*(prepare(track) for track in self._tracks))
+        self.calculate_bpm()
+
+    def analyse_parallel(self, max_workers: Optional[int] = None) -> None:
+        """
+        Calculate tempo and downbeats of every track in the group in separate processes.
+        Workers are sent the tracks themselves, so each is analysed with its own settings,
+        and return only their analysis.
+        Tracks whose audio is not loaded are sent without it and loaded by the worker.
+
+        Parameters
+        ----------
+        max_workers : Optional[int]
+            maximum number of worker processes
+            if None, one per CPU
+
+        Raises
+        ------
+        ValueError
+            If a track in the group has no audio loaded and was not created from a file path
+        """
+        if not all(
+            track.audio.size > 0 or isinstance(track._source, str)
+            for track in self._tracks
+        ):
+            raise ValueError("Only tracks created from a file path can be analysed")
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            analyses = executor.map(_analyse_track, self._tracks)
+            for track, (bpm, downbeats, beats) in zip(self._tracks, analyses):
+                track._bpm = bpm
+                track._set_downbeats(downbeats)
+                track._beats = beats
+
+        self.calculate_bpm()
+
+        logger.info(f"Analysed {len(self._tracks)} tracks in parallel")
+
+
+def _analyse_track(track: TrackProcessor) -> tuple[float, np.ndarray, np.ndarray]:
+    """
+    Calculate the tempo and downbeats of a track that have not yet been calculated.
+
+    Parameters
+    ----------
+    track : TrackProcessor
+        track to analyse, loaded first if its audio is not loaded
+
+    Returns
+    -------
+    bpm : float
+        tempo of audio file
+    downbeats : np.ndarray
+        downbeat time points of audio file
+    beats : np.ndarray
+        beat time points of audio file
+    """
+    if track.audio.size == 0:
+        track.load()
+    # Beats tracked with the downbeats give the tempo without a second analysis pass
+    if track.downbeats.size == 0:
+        track.calculate_downbeats()
+    bpm = track.bpm if track.bpm is not None else track.calculate_bpm()
+    return bpm, track.downbeats, track._beats
+
+
+def _thread_cache(factory: Callable[..., T]) -> Callable[..., T]:
+    """
+    Cache the processors built by a factory separately for each thread.
+    madmom and essentia processors hold state while processing,
+    so a cached processor is only reused by the thread that created it.
+
+    Parameters
+    ----------
+    factory : Callable[..., T]
+        function building a processor from hashable positional arguments
+
+    Returns
+    -------
+    Callable[..., T]
+        factory returning the calling thread's processor for the given arguments
+    """
+
+    @functools.wraps(factory)
+    def cached_factory(*args: Hashable) -> T:
+        processors = getattr(_thread_processors, factory.__name__, None)
+        if processors is None:
+            processors = {}
+            setattr(_thread_processors, factory.__name__, processors)
+        if args not in processors:
+            processors[args] = factory(*args)
+        return processors[args]
+
+    return cached_factory
+
+
+@_thread_cache
+def _get_rhythm_extractor() -> es.RhythmExtractor2013:
+    """
+    Shared essentia beat tracker, so its algorithm network is configured once per thread.
+
+    Returns
+    -------
+    es.RhythmExtractor2013
+        algorithm estimating tempo and beat positions of audio
+    """
+    return es.RhythmExtractor2013(method="degara")
+
+
+@_thread_cache
+def _get_bpm_estimator() -> es.PercivalBpmEstimator:
+    """
+    Shared lightweight essentia tempo estimator, configured once per thread.
+
+    Returns
+    -------
+    es.PercivalBpmEstimator
+        algorithm estimating tempo of audio
+    """
+    return es.PercivalBpmEstimator(sampleRate=SAMPLE_RATE)
+
+
+@_thread_cache
+def _get_rnn(num_threads: int = 1) -> RNNDownBeatProcessor:
+    """
+    Shared madmom downbeat activation processor, so the network weights load once per thread.
+
+    Parameters
+    ----------
+    num_threads : int
+        number of processes the ensemble's networks are spread across
+        madmom starts a process pool for each processor with more than one
+
+    Returns
+    -------
+    RNNDownBeatProcessor
+        processor mapping audio to beat and downbeat activations
+    """
+    return RNNDownBeatProcessor(num_threads=num_threads)
+
+
+@_thread_cache
+def _get_dbn(
+    beats_per_bar: tuple[int, ...],
+    fps: int,
+    min_bpm: float = 55.0,
+    max_bpm: float = 205.0,
+) -> DBNDownBeatTrackingProcessor:
+    """
+    Shared madmom downbeat tracker, so the HMM transition model is built once per thread
+    for each configuration.
+
+    Parameters
+    ----------
+    beats_per_bar : tuple[int, ...]
+        numbers of beats per bar to model
+    fps : int
+        frame rate of the activations
+    min_bpm : float
+        slowest tempo modelled, madmom's default if not given
+    max_bpm : float
+        fastest tempo modelled, madmom's default if not given
+
+    Returns
+    -------
+    DBNDownBeatTrackingProcessor
+        processor decoding activations into beat time points and bar positions
+    """
+    return DBNDownBeatTrackingProcessor(
+        beats_per_bar=list(beats_per_bar), min_bpm=min_bpm, max_bpm=max_bpm, fps=fps
+    )